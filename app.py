@@ -2,9 +2,13 @@ import os
 import logging
 import json
 import time
-from flask import Flask, render_template, request, jsonify, Response
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+from flask import Flask, render_template, request, Response
+from service_streamer import ThreadedStreamer
 from vehicle_detector import VehicleDetector
-from scheduler import TrafficScheduler, Lane
+from scheduler import TrafficScheduler, Lane, to_count
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -13,12 +17,48 @@ logger = logging.getLogger(__name__)
 # Create Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "default_secret_key")
+# Cap upload size so per-request image buffers stay bounded (four lane images)
+app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024
 
-# Initialize the vehicle detector
-detector = VehicleDetector()
+# The vehicle detector and its batching streamer are created on first use, inside
+# the serving worker, so the CUDA context is never created in a forking parent
+detector = None
+streamer = None
+_detector_lock = threading.Lock()
+
+# Decodes lane uploads in parallel; OpenCV and libjpeg-turbo release the GIL while decoding
+_decode_pool = ThreadPoolExecutor(max_workers=4)
+
+def get_detector():
+    """Return the shared vehicle detector, loading the models on first call."""
+    global detector
+    if detector is None:
+        with _detector_lock:
+            if detector is None:
+                detector = VehicleDetector()
+    return detector
+
+def detect_streamed_batch(items):
+    """Run detection for (image, return_boxes) pairs gathered by the streamer."""
+    return get_detector().detect_vehicles_batch(
+        [img for img, _ in items],
+        return_boxes=[return_boxes for _, return_boxes in items]
+    )
+
+def get_streamer():
+    """Return the shared streamer that merges images from concurrent requests into detector batches."""
+    global streamer
+    if streamer is None:
+        get_detector()
+        with _detector_lock:
+            if streamer is None:
+                streamer = ThreadedStreamer(detect_streamed_batch, batch_size=16, max_latency=0.01)
+    return streamer
 
 # Initialize the traffic scheduler
 scheduler = TrafficScheduler()
+# Request threads share the scheduler and lanes; hold this while reading or changing them
+scheduler_lock = threading.Lock()
 
 # Create lanes
 north_lane = Lane("North", 0)
@@ -29,6 +69,9 @@ west_lane = Lane("West", 3)
 lanes = [north_lane, east_lane, south_lane, west_lane]
 scheduler.set_lanes(lanes)
 
+# Upload field name and lane index for each lane, in scheduling order
+_LANES = (("north", 0), ("east", 1), ("south", 2), ("west", 3))
+
 # Placeholder for demo images - in a real implementation, these would be captured from cameras
 demo_images = {
     "north": None,
@@ -37,6 +80,52 @@ demo_images = {
     "west": None
 }
 
+def read_upload(file):
+    """
+    Read an uploaded file into a single preallocated buffer.
+    
+    Avoids the extra copy of file.read(), which builds a bytes object from
+    Werkzeug's already spooled upload.
+    """
+    stream = file.stream
+    if not hasattr(stream, 'readinto'):
+        # SpooledTemporaryFile only gained readinto in Python 3.11
+        return stream.read()
+    # Size the buffer from the spool itself, which MAX_CONTENT_LENGTH bounds; the
+    # part's own Content-Length header is client-controlled and never checked
+    start = stream.tell()
+    size = stream.seek(0, os.SEEK_END) - start
+    stream.seek(start)
+    buf = bytearray(size)
+    view = memoryview(buf)
+    read = 0
+    while read < size:
+        n = stream.readinto(view[read:])
+        if not n:
+            break
+        read += n
+    return view[:read] if read < size else buf
+
+def validate_lane_counts(lane_counts):
+    """
+    Validate (regular, emergency) counts for several lanes before any lane is updated.
+    
+    Raises:
+        ValueError: If there are more entries than lanes or a count is invalid
+    """
+    if len(lane_counts) > len(lanes):
+        raise ValueError(f"Expected at most {len(lanes)} lanes, got {len(lane_counts)}")
+    return [(to_count(regular_count), to_count(emergency_count))
+            for regular_count, emergency_count in lane_counts]
+
+def json_response(payload, status=200):
+    """Serialize a payload with orjson into a JSON response."""
+    return app.response_class(
+        orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY),
+        status=status,
+        mimetype='application/json'
+    )
+
 @app.route('/')
 def index():
     """Render the main page."""
@@ -48,35 +137,53 @@ def detect_vehicles():
     try:
         files = request.files
         detection_results = {}
-        
-        for lane_direction in ['north', 'east', 'south', 'west']:
+        # Per-box detection details are only built when the client asks for them
+        return_boxes = 'with_boxes' in request.args
+
+        # Read every uploaded lane image (cheap), then decode them in parallel
+        # so detection runs as one batch
+        uploads = []
+        for lane_direction, lane_index in (_LANES if files else ()):
             if lane_direction in files:
                 file = files[lane_direction]
                 # Read the file as bytes for YOLOv8 detection
-                image_bytes = file.read()
-                # Run real vehicle detection
-                result = detector.detect_vehicles(image_bytes)
+                uploads.append((lane_direction, lane_index, read_upload(file)))
+
+        decode_image = get_detector().decode_image
+        pending = [(lane_direction, lane_index, _decode_pool.submit(decode_image, image_bytes))
+                   for lane_direction, lane_index, image_bytes in uploads]
+        directions = []
+        images = []
+        for lane_direction, lane_index, future in pending:
+            try:
+                images.append(future.result())
+                directions.append((lane_direction, lane_index))
+            except Exception as e:
+                logger.error(f"Could not decode {lane_direction} image: {str(e)}")
+                detection_results[lane_direction] = VehicleDetector._empty_result(e, return_boxes)
+
+        # Run real vehicle detection on all lanes at once
+        results = get_streamer().predict([(img, return_boxes) for img in images]) if images else []
+        counts = validate_lane_counts([(result["regular_count"], result["emergency_count"]) for result in results])
+        with scheduler_lock:
+            for (lane_direction, lane_index), result, (regular_count, emergency_count) in zip(directions, results, counts):
                 detection_results[lane_direction] = result
                 # Update corresponding lane in the scheduler
-                lane_index = {"north": 0, "east": 1, "south": 2, "west": 3}[lane_direction]
-                lanes[lane_index].update_vehicles(result["regular_count"], result["emergency_count"])
-        
-        # Determine the scheduling algorithm based on vehicle counts
-        scheduler.select_algorithm()
+                lanes[lane_index].update_vehicles(regular_count, emergency_count)
         
-        # Get the next lane to be given green light
-        next_green_lane = scheduler.schedule_next_lane()
+            # Pick the algorithm for the current vehicle counts and get the next lane to be given green light
+            next_green_lane = scheduler.tick()
         
-        return jsonify({
-            "detection_results": detection_results,
-            "next_green_lane": next_green_lane,
-            "current_algorithm": scheduler.current_algorithm,
-            "lane_data": [lane.to_dict() for lane in lanes]
-        })
+            return json_response({
+                "detection_results": detection_results,
+                "next_green_lane": next_green_lane,
+                "current_algorithm": scheduler.current_algorithm,
+                "lane_data": [lane.to_dict() for lane in lanes]
+            })
     
     except Exception as e:
         logger.error(f"Error in detect_vehicles: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
 
 @app.route('/manual_input', methods=['POST'])
 def manual_input():
@@ -85,37 +192,36 @@ def manual_input():
         data = request.json
         logger.debug(f"Received manual input: {data}")
         if data is None:
-            return jsonify({"error": "No JSON data received"}), 400
-        # Update lanes with manual vehicle counts
-        for lane_id, lane_data in enumerate(data.get('lanes', [])):
-            regular_count = lane_data.get('regular_count', 0)
-            emergency_count = lane_data.get('emergency_count', 0)
+            return json_response({"error": "No JSON data received"}, 400)
+        # Validate every lane's counts first so a bad value leaves all lanes unchanged
+        try:
+            counts = validate_lane_counts([
+                (lane_data.get('regular_count', 0), lane_data.get('emergency_count', 0))
+                for lane_data in data.get('lanes', [])
+            ])
+        except ValueError as e:
+            return json_response({"error": str(e)}, 400)
+        with scheduler_lock:
+            # Update lanes with manual vehicle counts
+            for lane_id, (regular_count, emergency_count) in enumerate(counts):
+                # Update lane
+                lanes[lane_id].update_vehicles(regular_count, emergency_count)
             
-            # Validate input - don't clamp vehicle counts anymore
-            regular_count = max(0, regular_count)
-            emergency_count = max(0, emergency_count)
-            
-            # Update lane
-            lanes[lane_id].update_vehicles(regular_count, emergency_count)
-            
-            logger.debug(f"Updated lane {lane_id} with {regular_count} regular, {emergency_count} emergency vehicles")
+                logger.debug(f"Updated lane {lane_id} with {regular_count} regular, {emergency_count} emergency vehicles")
         
-        # Determine the scheduling algorithm based on vehicle counts
-        scheduler.select_algorithm()
+            # Pick the algorithm for the current vehicle counts and get the next lane to be given green light
+            next_green_lane = scheduler.tick()
         
-        # Get the next lane to be given green light
-        next_green_lane = scheduler.schedule_next_lane()
-        
-        return jsonify({
-            "success": True,
-            "next_green_lane": next_green_lane,
-            "current_algorithm": scheduler.current_algorithm,
-            "lane_data": [lane.to_dict() for lane in lanes]
-        })
+            return json_response({
+                "success": True,
+                "next_green_lane": next_green_lane,
+                "current_algorithm": scheduler.current_algorithm,
+                "lane_data": [lane.to_dict() for lane in lanes]
+            })
     
     except Exception as e:
         logger.error(f"Error in manual_input: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
 
 @app.route('/simulate_step', methods=['POST'])
 def simulate_step():
@@ -124,73 +230,79 @@ def simulate_step():
         # Get current state from frontend
         data = request.json
         if data is None:
-            return jsonify({"error": "No JSON data received"}), 400
-        
-        # Update lane data with vehicle counts
-        for i, lane_data in enumerate(data.get('lanes', [])):
-            lanes[i].vehicle_count = lane_data.get('vehicle_count', 0)
-            lanes[i].emergency_count = lane_data.get('emergency_count', 0)
+            return json_response({"error": "No JSON data received"}, 400)
+        # Validate every lane's counts first so a bad value leaves all lanes unchanged
+        try:
+            counts = validate_lane_counts([
+                (lane_data.get('vehicle_count', 0), lane_data.get('emergency_count', 0))
+                for lane_data in data.get('lanes', [])
+            ])
+        except ValueError as e:
+            return json_response({"error": str(e)}, 400)
         
-        # Update intersection crossing status
-        # This tells the scheduler if vehicles have finished crossing the intersection
-        intersection_clear = data.get('intersection_clear', True)
+        with scheduler_lock:
+            # Update lane data with vehicle counts
+            for i, (regular_count, emergency_count) in enumerate(counts):
+                lanes[i].update_vehicles(regular_count, emergency_count)
         
-        # Get list of lanes with vehicles in the intersection
-        vehicles_in_intersection = data.get('vehicles_in_intersection', [])
+            # Update intersection crossing status
+            # This tells the scheduler if vehicles have finished crossing the intersection
+            intersection_clear = data.get('intersection_clear', True)
         
-        # Update the scheduler with intersection status
-        scheduler.set_lane_crossing_status(intersection_clear)
+            # Get list of lanes with vehicles in the intersection
+            vehicles_in_intersection = data.get('vehicles_in_intersection', [])
         
-        # If the intersection is not clear, we need to ensure vehicles complete crossing
-        if not intersection_clear and vehicles_in_intersection:
-            # Check if the current green lane has a vehicle in the intersection
-            current_green_lane = scheduler.current_green_lane_id
-            if current_green_lane in vehicles_in_intersection:
-                # Don't change the green lane - let vehicle complete crossing
-                next_green_lane = current_green_lane
-                app.logger.debug(f"Keeping lane {current_green_lane} green to clear intersection")
-                return jsonify({
-                    "next_green_lane": next_green_lane,
-                    "current_algorithm": scheduler.current_algorithm,
-                    "lane_data": [lane.to_dict() for lane in lanes]
-                })
+            # Update the scheduler with intersection status
+            scheduler.set_lane_crossing_status(intersection_clear)
         
-        # Update the algorithm based on current vehicle counts
-        scheduler.select_algorithm()
+            # If the intersection is not clear, we need to ensure vehicles complete crossing
+            if not intersection_clear and vehicles_in_intersection:
+                # Check if the current green lane has a vehicle in the intersection
+                current_green_lane = scheduler.current_green_lane_id
+                if current_green_lane in vehicles_in_intersection:
+                    # Don't change the green lane - let vehicle complete crossing
+                    next_green_lane = current_green_lane
+                    app.logger.debug(f"Keeping lane {current_green_lane} green to clear intersection")
+                    return json_response({
+                        "next_green_lane": next_green_lane,
+                        "current_algorithm": scheduler.current_algorithm,
+                        "lane_data": [lane.to_dict() for lane in lanes]
+                    })
         
-        # Get the next lane to be given green light
-        next_green_lane = scheduler.schedule_next_lane()
+            # Pick the algorithm for the current vehicle counts and get the next lane to be given green light
+            next_green_lane = scheduler.tick()
         
-        # Simulate vehicle movement (handled by frontend)
-        return jsonify({
-            "next_green_lane": next_green_lane,
-            "current_algorithm": scheduler.current_algorithm,
-            "lane_data": [lane.to_dict() for lane in lanes]
-        })
+            # Simulate vehicle movement (handled by frontend)
+            return json_response({
+                "next_green_lane": next_green_lane,
+                "current_algorithm": scheduler.current_algorithm,
+                "lane_data": [lane.to_dict() for lane in lanes]
+            })
     
     except Exception as e:
         logger.error(f"Error in simulate_step: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
 
 @app.route('/reset', methods=['POST'])
 def reset_simulation():
     """Reset the traffic simulation."""
     try:
-        for lane in lanes:
-            lane.vehicle_count = 0
-            lane.emergency_count = 0
-            lane.processed_time = 0
+        with scheduler_lock:
+            for lane in lanes:
+                lane.update_vehicles(0, 0)
+                lane.processed_time = 0
         
-        scheduler.reset()
+            scheduler.reset()
         
-        return jsonify({
-            "success": True,
-            "lane_data": [lane.to_dict() for lane in lanes]
-        })
+            return json_response({
+                "success": True,
+                "lane_data": [lane.to_dict() for lane in lanes]
+            })
     
     except Exception as e:
         logger.error(f"Error in reset_simulation: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
 
 if __name__ == "__main__":
+    # Local debugging only; serve with gunicorn in production (see README)
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,41 @@
+import argparse
+import os
+from ultralytics import YOLO
+from vehicle_detector import EMERGENCY_MODEL_PATH, GENERAL_MODEL_PATH, ENGINE_BATCH_SIZE
+
+def export_engine(weights, int8_data=None):
+    """
+    Export YOLOv8 weights to a static-shape TensorRT engine.
+
+    FP16 engines are written next to the weights with an .engine suffix. When
+    int8_data (a dataset YAML of representative frames) is given, an INT8
+    engine calibrated on it is written with an .int8.engine suffix instead.
+    VehicleDetector picks both up automatically. Engines must be rebuilt on
+    the deployment machine whenever TensorRT is upgraded.
+    """
+    engine = YOLO(weights).export(
+        format='engine',
+        half=int8_data is None,
+        int8=int8_data is not None,
+        data=int8_data,
+        batch=ENGINE_BATCH_SIZE,
+        imgsz=640,
+        dynamic=False,
+        workspace=2
+    )
+    if int8_data is not None:
+        int8_engine = os.path.splitext(engine)[0] + '.int8.engine'
+        os.replace(engine, int8_engine)
+        engine = int8_engine
+    return engine
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build TensorRT engines for the vehicle detector")
+    parser.add_argument('--int8', metavar='DATA_YAML',
+                        help="also build INT8 engines calibrated on this dataset YAML")
+    args = parser.parse_args()
+    for weights in (EMERGENCY_MODEL_PATH, GENERAL_MODEL_PATH):
+        # INT8 first: Ultralytics always writes <name>.engine, which the FP16 export then claims
+        if args.int8:
+            print(f"Exported {export_engine(weights, int8_data=args.int8)}")
+        print(f"Exported {export_engine(weights)}")
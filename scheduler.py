@@ -1,7 +1,7 @@
 import time
 import logging
 from enum import Enum
-import heapq
+import numpy as np
 
 class SchedulingAlgorithm(Enum):
     """Enum for different scheduling algorithms."""
@@ -9,9 +9,44 @@ class SchedulingAlgorithm(Enum):
     PRIORITY = "Priority Scheduling"
     ROUND_ROBIN = "Round Robin"
 
+# Largest count accepted per field, so a lane's regular + emergency total still fits in int64
+_MAX_COUNT = int(np.iinfo(np.int64).max) // 2
+
+def to_count(value):
+    """
+    Validate a vehicle count and return it as an int.
+    
+    Raises:
+        ValueError: If the value is not a non-negative integer
+    """
+    try:
+        count = int(value)
+    except (TypeError, ValueError, OverflowError):
+        count = None
+    if count is None or count != value or not 0 <= count <= _MAX_COUNT:
+        raise ValueError(f"Vehicle count must be a non-negative integer, got {value!r}")
+    return count
+
+def _state_property(key, read_only=False):
+    """Create a lane attribute stored in the lane's cached JSON state."""
+    def getter(self):
+        return self._state[key]
+    def setter(self, value):
+        self._state[key] = value
+    return property(getter) if read_only else property(getter, setter)
+
 class Lane:
     """Class representing a traffic lane."""
     
+    # Attributes that appear in to_dict() live in _state so it never has to be rebuilt
+    # Vehicle counts are also mirrored in the scheduler's arrays, so they only change through update_vehicles
+    vehicle_count = _state_property("vehicle_count", read_only=True)
+    emergency_count = _state_property("emergency_count", read_only=True)
+    processed_time = _state_property("processed_time")
+    waiting_time = _state_property("waiting_time")
+    is_green = _state_property("is_green")
+    has_vehicle_in_intersection = _state_property("has_vehicle_in_intersection")
+    
     def __init__(self, name, lane_id):
         """
         Initialize a lane.
@@ -20,36 +55,49 @@ class Lane:
             name: Name/direction of the lane (e.g., "North")
             lane_id: Unique ID for the lane (0-3)
         """
+        self._state = {
+            "name": name,
+            "id": lane_id,
+            "vehicle_count": 0,
+            "emergency_count": 0,
+            "processed_time": 0,
+            "waiting_time": 0,
+            "is_green": False,
+            "has_vehicle_in_intersection": False
+        }
         self.name = name
         self.id = lane_id
-        self.vehicle_count = 0
-        self.emergency_count = 0
         self.processed_time = 0  # Time this lane has been serviced
         self.waiting_time = 0  # Time this lane has been waiting
         self.is_green = False
         self.has_vehicle_in_intersection = False  # Track if a vehicle from this lane is in the intersection
+        self.scheduler = None  # Scheduler holding this lane's counts in its arrays, set by TrafficScheduler.set_lanes
     
     def update_vehicles(self, regular_count, emergency_count):
-        """Update the vehicle counts for this lane."""
-        self.vehicle_count = regular_count
-        self.emergency_count = emergency_count
+        """
+        Update the vehicle counts for this lane.
+        
+        Raises:
+            ValueError: If a count is not a non-negative integer; the lane is left unchanged
+        """
+        regular_count = to_count(regular_count)
+        emergency_count = to_count(emergency_count)
+        if self.scheduler is not None:
+            self.scheduler._set_counts(self.id, regular_count, emergency_count)
+        self._state["vehicle_count"] = regular_count
+        self._state["emergency_count"] = emergency_count
     
     def get_total_vehicles(self):
         """Get the total number of vehicles in the lane."""
         return self.vehicle_count + self.emergency_count
     
     def to_dict(self):
-        """Convert lane information to dictionary for JSON serialization."""
-        return {
-            "name": self.name,
-            "id": self.id,
-            "vehicle_count": self.vehicle_count,
-            "emergency_count": self.emergency_count,
-            "processed_time": self.processed_time,
-            "waiting_time": self.waiting_time,
-            "is_green": self.is_green,
-            "has_vehicle_in_intersection": self.has_vehicle_in_intersection
-        }
+        """
+        Convert lane information to dictionary for JSON serialization.
+        
+        The returned dict is the lane's live cached state; callers must not modify it.
+        """
+        return self._state
 
 class TrafficScheduler:
     """Class to handle traffic signal scheduling using various algorithms."""
@@ -65,10 +113,38 @@ class TrafficScheduler:
         self.consecutive_cycles = 0  # Track how many consecutive times a lane has been green
         self.lane_crossings_complete = True  # Flag to track if vehicles have fully crossed the intersection
         self.vehicle_quota = 0  # Number of vehicles allowed to pass in current lane before switching
+        # Per-lane counts as arrays indexed by lane id, kept current by Lane.update_vehicles
+        self._vehicle_counts = np.zeros(0, np.int64)
+        self._emergency_counts = np.zeros(0, np.int64)
+        self._rr_next = []  # Round-robin visiting order after each lane
     
     def set_lanes(self, lanes):
         """Set the lanes for the scheduler."""
         self.lanes = lanes
+        num_lanes = len(lanes)
+        self._vehicle_counts = np.zeros(num_lanes, np.int64)
+        self._emergency_counts = np.zeros(num_lanes, np.int64)
+        # _rr_next[cur] lists the lanes to try after lane cur; index -1 (no green
+        # lane yet) lands on the last row, which starts from lane 0
+        self._rr_next = [[(cur + i) % num_lanes for i in range(1, num_lanes + 1)] for cur in range(num_lanes)]
+        for lane in lanes:
+            lane.scheduler = self
+            self._set_counts(lane.id, lane.vehicle_count, lane.emergency_count)
+    
+    def _set_counts(self, lane_id, regular_count, emergency_count):
+        """Store a lane's vehicle counts in the scheduler's count arrays."""
+        self._vehicle_counts[lane_id] = regular_count
+        self._emergency_counts[lane_id] = emergency_count
+    
+    def _summarize_counts(self):
+        """
+        Summarize the count arrays for one scheduling step.
+        
+        Returns:
+            tuple: (per-lane vehicle totals, ids of non-empty lanes, whether any lane has emergency vehicles)
+        """
+        total = self._vehicle_counts + self._emergency_counts
+        return total, np.flatnonzero(total), bool(self._emergency_counts.any())
     
     def reset(self):
         """Reset the scheduler."""
@@ -87,32 +163,31 @@ class TrafficScheduler:
         # Select initial algorithm based on vehicle counts
         self.select_algorithm()
     
-    def select_algorithm(self):
+    def select_algorithm(self, summary=None):
         """
         Select the appropriate scheduling algorithm based on current traffic conditions.
         
         - SJF: When there's a significant gap between lanes (at least 10 vehicles difference)
         - Priority: When there are emergency vehicles
         - Round Robin: Default for normal traffic conditions
+        
+        Args:
+            summary: Result of _summarize_counts() for the current counts, computed here if not given
         """
+        total, nonempty_ids, has_emergency = summary or self._summarize_counts()
+        
         # Check for emergency vehicles first
-        emergency_vehicles = sum(lane.emergency_count for lane in self.lanes)
-        if emergency_vehicles > 0:
+        if has_emergency:
             self.current_algorithm = SchedulingAlgorithm.PRIORITY.value
             self.logger.debug(f"Selected algorithm: {self.current_algorithm} (emergency vehicles present)")
             return
             
-        # Check for significant differences between lanes
-        lane_vehicle_counts = []
-        for lane in self.lanes:
-            vehicles = lane.get_total_vehicles()
-            if vehicles > 0:  # Only consider non-empty lanes
-                lane_vehicle_counts.append((lane.id, vehicles))
-        
-        if len(lane_vehicle_counts) >= 2:  # Need at least 2 lanes with vehicles
+        # Check for significant differences between non-empty lanes
+        if len(nonempty_ids) >= 2:  # Need at least 2 lanes with vehicles
             # Get min and max vehicle counts
-            min_lane_id, min_vehicles = min(lane_vehicle_counts, key=lambda x: x[1])
-            max_lane_id, max_vehicles = max(lane_vehicle_counts, key=lambda x: x[1])
+            counts = total[nonempty_ids]
+            min_lane_id, max_lane_id = nonempty_ids[counts.argmin()], nonempty_ids[counts.argmax()]
+            min_vehicles, max_vehicles = total[min_lane_id], total[max_lane_id]
             
             # Use SJF if there's at least a 10-vehicle gap between min and max
             if max_vehicles - min_vehicles >= 5:  
@@ -124,11 +199,28 @@ class TrafficScheduler:
         self.current_algorithm = SchedulingAlgorithm.ROUND_ROBIN.value
         self.logger.debug(f"Selected algorithm: {self.current_algorithm} (default)")
     
-    def schedule_next_lane(self):
+    def tick(self):
+        """
+        Run one scheduling step: pick the algorithm for current traffic, then schedule the next lane.
+        
+        The count summaries (lane totals, non-empty lanes, emergency presence) are
+        computed once and shared by algorithm selection and the scheduling step.
+        
+        Returns:
+            int: The ID of the lane that should get a green light
+        """
+        summary = self._summarize_counts()
+        self.select_algorithm(summary)
+        return self.schedule_next_lane(summary)
+    
+    def schedule_next_lane(self, summary=None):
         """
         Schedule the next lane to get a green light based on the selected algorithm.
         Only changes lanes when vehicles have fully crossed the intersection.
         
+        Args:
+            summary: Result of _summarize_counts() for the current counts, computed here if not given
+        
         Returns:
             int: The ID of the lane that should get a green light
         """
@@ -137,19 +229,20 @@ class TrafficScheduler:
             # Return the current green lane if there are still vehicles crossing
             return self.current_green_lane_id
             
-        # Reset the green status for all lanes
-        for lane in self.lanes:
-            lane.is_green = False
+        # Reset the green status; only the current green lane can have it set
+        if 0 <= self.current_green_lane_id < len(self.lanes):
+            self.lanes[self.current_green_lane_id].is_green = False
         
         # Store previous green lane for comparison
         prev_green_lane = self.current_green_lane_id
         
+        summary = summary or self._summarize_counts()
         if self.current_algorithm == SchedulingAlgorithm.SJF.value:
-            next_lane_id = self._schedule_sjf()
+            next_lane_id = self._schedule_sjf(summary)
         elif self.current_algorithm == SchedulingAlgorithm.PRIORITY.value:
-            next_lane_id = self._schedule_priority()
+            next_lane_id = self._schedule_priority(summary)
         else:  # Default to Round Robin
-            next_lane_id = self._schedule_round_robin()
+            next_lane_id = self._schedule_round_robin(summary)
         
         # Update the green status for the selected lane
         if next_lane_id >= 0 and next_lane_id < len(self.lanes):
@@ -171,27 +264,29 @@ class TrafficScheduler:
         """
         self.lane_crossings_complete = is_complete
     
-    def _schedule_sjf(self):
+    def _schedule_sjf(self, summary):
         """
         Implement Shortest Job First scheduling algorithm.
         
         Returns:
             int: The ID of the lane with the fewest vehicles
         """
+        total, nonempty_ids, has_emergency = summary
+        
         # If all lanes are empty, return -1
-        if all(lane.get_total_vehicles() == 0 for lane in self.lanes):
+        if len(nonempty_ids) == 0:
             return -1
         
         # Using a vehicle quota system with half the vehicles (similar to Round Robin)
         
         # If current lane still has vehicles and hasn't reached the quota, keep it green
         if (self.current_green_lane_id >= 0 and 
-            self.lanes[self.current_green_lane_id].get_total_vehicles() > 0):
+            total[self.current_green_lane_id] > 0):
             
             # If this is the first cycle for this lane, initialize vehicle quota
             if self.consecutive_cycles == 0:
                 # Set quota to 50% of vehicles in lane (min 1, max 2)
-                total_vehicles = self.lanes[self.current_green_lane_id].get_total_vehicles()
+                total_vehicles = int(total[self.current_green_lane_id])
                 self.vehicle_quota = min(2, max(1, total_vehicles // 2))
                 self.consecutive_cycles = 1
                 self.logger.debug(f"SJF set quota of {self.vehicle_quota} vehicles for lane {self.current_green_lane_id}")
@@ -208,48 +303,40 @@ class TrafficScheduler:
         # Reset consecutive cycles counter as we're switching lanes
         self.consecutive_cycles = 0  # Set to 0 so next lane initializes its quota
             
-        # Find the lane with the smallest number of vehicles
-        lane_vehicle_counts = []
-        for lane in self.lanes:
-            total_vehicles = lane.get_total_vehicles()
-            if total_vehicles > 0:  # Only consider non-empty lanes
-                lane_vehicle_counts.append((lane.id, total_vehicles))
-        
-        # If no lane has vehicles, return -1
-        if not lane_vehicle_counts:
-            return -1
-        
-        # Sort lanes by vehicle count and get the one with fewest vehicles
-        lane_vehicle_counts.sort(key=lambda x: x[1])  # Sort by vehicle count
-        min_lane_id, min_vehicles = lane_vehicle_counts[0]
+        # Find the non-empty lane with the smallest number of vehicles;
+        # argmin returns the first minimum, i.e. the lowest lane id on ties
+        min_lane_id = int(nonempty_ids[total[nonempty_ids].argmin()])
+        min_vehicles = int(total[min_lane_id])
         
         self.logger.debug(f"SJF selected lane {min_lane_id} with {min_vehicles} vehicles")
         return min_lane_id
     
-    def _schedule_priority(self):
+    def _schedule_priority(self, summary):
         """
         Implement Priority scheduling algorithm, prioritizing lanes with emergency vehicles.
         
         Returns:
             int: The ID of the highest priority lane
         """
+        total, nonempty_ids, has_emergency = summary
+        
         # If all lanes are empty, return -1
-        if all(lane.get_total_vehicles() == 0 for lane in self.lanes):
+        if len(nonempty_ids) == 0:
             return -1
             
         # Using a vehicle quota system similar to Round Robin but with higher quota for emergency
         
         # If current lane has vehicles and hasn't reached the quota, keep it green
         if (self.current_green_lane_id >= 0 and 
-            self.lanes[self.current_green_lane_id].get_total_vehicles() > 0):
+            total[self.current_green_lane_id] > 0):
             
             # If this is the first cycle for this lane, initialize vehicle quota
             if self.consecutive_cycles == 0:
                 # Set quota to 50% of vehicles for regular lanes, higher for emergency
-                total_vehicles = self.lanes[self.current_green_lane_id].get_total_vehicles()
+                total_vehicles = int(total[self.current_green_lane_id])
                 
                 # If this lane has emergency vehicles, give it a higher quota
-                if self.lanes[self.current_green_lane_id].emergency_count > 0:
+                if self._emergency_counts[self.current_green_lane_id] > 0:
                     self.vehicle_quota = max(2, total_vehicles // 2)
                     self.logger.debug(f"Priority set quota of {self.vehicle_quota} vehicles for lane {self.current_green_lane_id} with emergency vehicles")
                 else:
@@ -271,32 +358,28 @@ class TrafficScheduler:
         self.consecutive_cycles = 0  # Set to 0 so next lane initializes its quota
         
         # First check for lanes with emergency vehicles
-        emergency_lanes = []
-        for lane in self.lanes:
-            if lane.emergency_count > 0 and lane.get_total_vehicles() > 0:
-                emergency_lanes.append((lane.emergency_count, lane.id))
-        
-        if emergency_lanes:
-            # Sort by number of emergency vehicles (descending)
-            emergency_lanes.sort(reverse=True)
-            self.logger.debug(f"Priority selected lane {emergency_lanes[0][1]} with {emergency_lanes[0][0]} emergency vehicles")
-            return emergency_lanes[0][1]
+        if has_emergency:
+            # Lane with the most emergency vehicles, highest lane id on ties
+            lane_id = len(self._emergency_counts) - 1 - int(self._emergency_counts[::-1].argmax())
+            self.logger.debug(f"Priority selected lane {lane_id} with {self._emergency_counts[lane_id]} emergency vehicles")
+            return lane_id
         
         # If no emergency vehicles, fall back to SJF
         self.logger.debug("No emergency vehicles, falling back to SJF")
-        return self._schedule_sjf()
+        return self._schedule_sjf(summary)
     
-    def _schedule_round_robin(self):
-        
+    def _schedule_round_robin(self, summary):
+        total, nonempty_ids, has_emergency = summary
+
         # If all lanes are empty, return -1
-        if all(lane.get_total_vehicles() == 0 for lane in self.lanes):
+        if len(nonempty_ids) == 0:
             return -1
 
         max_vehicles_per_cycle = 5  # Each lane can pass maximum 5 vehicles during its turn
 
         # If current lane has vehicles and quota left, keep it green
         if (self.current_green_lane_id >= 0 and 
-            self.lanes[self.current_green_lane_id].get_total_vehicles() > 0):
+            total[self.current_green_lane_id] > 0):
 
             if self.consecutive_cycles < max_vehicles_per_cycle:
                 # Allow vehicles to pass
@@ -308,9 +391,8 @@ class TrafficScheduler:
         self.consecutive_cycles = 0  # Reset for the next lane
 
         # Find the next lane with available vehicles
-        for i in range(1, len(self.lanes) + 1):
-            next_lane_id = (self.current_green_lane_id + i) % len(self.lanes)
-            if self.lanes[next_lane_id].get_total_vehicles() > 0:
+        for next_lane_id in self._rr_next[self.current_green_lane_id]:
+            if total[next_lane_id] > 0:
                 self.logger.debug(f"Round Robin switched to lane {next_lane_id}")
                 return next_lane_id
 
@@ -1,9 +1,29 @@
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import cv2
+import torch
 from ultralytics import YOLO
 
+try:
+    # SIMD libjpeg-turbo decoder; falls back to OpenCV when not installed
+    from turbojpeg import TurboJPEG, TJPF_BGR
+except ImportError:
+    TurboJPEG = None
+
+# YOLOv8 weights; a TensorRT build of either (same name, .engine/.int8.engine suffix) is used when present
+EMERGENCY_MODEL_PATH = 'C:/Users/ASUS/Desktop/finalfinal/tempo/tempo/emergency_vehicle_model/train2/weights/best.pt'
+GENERAL_MODEL_PATH = 'C:/Users/ASUS/Desktop/finalfinal/tempo/tempo/yolov8n.pt'
+# Static batch size TensorRT engines are exported with (one image per lane)
+ENGINE_BATCH_SIZE = 4
+# INT8 engines (.int8.engine) are preferred over FP16 ones when present. The emergency
+# model stays on FP16 unless its INT8 accuracy has been validated on held-out frames
+EMERGENCY_MODEL_INT8 = False
+
+# Input shapes are fixed (letterboxed to 640), so let cuDNN pick its fastest kernels once
+torch.backends.cudnn.benchmark = True
+
 class VehicleDetector:
     """
     Class for real vehicle detection using YOLOv8 models.
@@ -13,87 +33,319 @@ class VehicleDetector:
         """Initialize the vehicle detector and load YOLOv8 models."""
         self.logger = logging.getLogger(__name__)
         self.logger.info("Vehicle detector initialized (YOLOv8)")
-        # Paths relative to this file's location
-        base_dir = os.path.dirname(os.path.abspath(__file__))
+        self._jpeg = None
+        if TurboJPEG is not None:
+            try:
+                self._jpeg = TurboJPEG()
+            except (OSError, RuntimeError) as e:
+                self.logger.warning(f"libjpeg-turbo unavailable, using OpenCV decode: {str(e)}")
+        # Inference settings shared by every model call (FP16 only makes sense on GPU)
+        use_cuda = torch.cuda.is_available()
+        self._imgsz = 640
+        self._infer_kwargs = dict(
+            verbose=False,
+            half=use_cuda,
+            device=0 if use_cuda else 'cpu',
+            imgsz=self._imgsz
+        )
+        # On GPU, batches are letterboxed on the CPU and uploaded through a
+        # pinned staging buffer so normalization happens on the device
+        self._device = torch.device('cuda', 0) if use_cuda else None
+        self._staging = None
+        # One CUDA stream per model; the emergency model is driven from a helper
+        # thread so both models' kernels can overlap on the GPU
+        if use_cuda:
+            self._stream_emergency = torch.cuda.Stream()
+            self._stream_general = torch.cuda.Stream()
+            self._stream_pool = ThreadPoolExecutor(max_workers=1)
+
         # Emergency vehicle model
-        self.model_emergency = YOLO('C:/Users/ASUS/Desktop/finalfinal/tempo/tempo/emergency_vehicle_model/train2/weights/best.pt')
+        self.model_emergency = self._load_model(EMERGENCY_MODEL_PATH, allow_int8=EMERGENCY_MODEL_INT8)
         # General vehicle model
-        self.model_general = YOLO('C:/Users/ASUS/Desktop/finalfinal/tempo/tempo/yolov8n.pt')
+        self.model_general = self._load_model(GENERAL_MODEL_PATH)
+        # TensorRT engines have a fixed input batch, so batches are split and padded to it
+        self._batch_size = ENGINE_BATCH_SIZE if self._uses_engine() else None
         # Emergency vehicle class names (from data.yaml)
         self.emergency_classes = [
             'ambulance_off', 'ambulance_on', 'firetruck_off', 'firetruck_on'
         ]
         # General vehicle classes
         self.general_vehicle_classes = ['car', 'truck', 'bus', 'motorcycle']
+        # Class ids of the general vehicle classes, for vectorized counting
+        self._general_ids = np.array(
+            [k for k, v in self.model_general.names.items() if v in self.general_vehicle_classes],
+            dtype=np.int64
+        )
 
-    def detect_vehicles(self, image):
+    def _load_model(self, weights, allow_int8=True):
+        """
+        Load and warm up a YOLO model, preferring a TensorRT engine built from the same weights.
+        Ultralytics only deserializes an engine on first use, so each candidate is
+        warmed up here and skipped if that fails.
+        Args:
+            weights: Path to the PyTorch .pt weights
+            allow_int8: Whether an INT8 engine may be used
+        Returns:
+            YOLO: The loaded model
+        """
+        stem = os.path.splitext(weights)[0]
+        engines = [stem + '.int8.engine', stem + '.engine'] if allow_int8 else [stem + '.engine']
+        for engine in engines:
+            if self._device is None or not os.path.exists(engine):
+                continue
+            try:
+                import tensorrt
+                model = YOLO(engine, task='detect')
+                self._warmup(model)
+                self.logger.info(f"Loaded TensorRT {tensorrt.__version__} engine {engine}")
+                return model
+            except Exception as e:
+                # Engines are tied to the TensorRT version that built them
+                self.logger.warning(f"Could not load {engine}: {str(e)}")
+        model = YOLO(weights)
+        # Fold Conv+BN layers before the first forward pass
+        model.fuse()
+        self._warmup(model)
+        return model
+
+    def _warmup(self, model):
+        """
+        Run a dummy batch through a model so the first real request doesn't pay
+        for engine loading, CUDA context setup or cuDNN tuning.
+        """
+        # One frame per lane: the engines' static batch and the usual /detect batch
+        warmup = [np.zeros((self._imgsz, self._imgsz, 3), np.uint8)] * ENGINE_BATCH_SIZE
+        with torch.inference_mode():
+            model.predict(warmup, **self._infer_kwargs)
+
+    @staticmethod
+    def _is_engine(model):
+        """Check whether a model is backed by a TensorRT engine."""
+        return str(model.ckpt_path).endswith('.engine')
+
+    def _uses_engine(self):
+        """Check whether either model is backed by a TensorRT engine."""
+        return self._is_engine(self.model_emergency) or self._is_engine(self.model_general)
+
+    def decode_image(self, image):
+        """
+        Decode an uploaded image into a BGR numpy array.
+        Args:
+            image: Image data as bytes-like object or numpy array (BGR)
+        Returns:
+            numpy.ndarray: Decoded BGR image
+        """
+        # Accept image as bytes (from Flask file upload) or as numpy array
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            if self._jpeg is not None:
+                try:
+                    return self._jpeg.decode(image, pixel_format=TJPF_BGR)
+                except (OSError, ValueError):
+                    pass  # Not a JPEG (e.g. PNG/WebP), let OpenCV handle it
+            npimg = np.frombuffer(image, np.uint8)
+            img = cv2.imdecode(npimg, cv2.IMREAD_COLOR)
+            if img is None:
+                raise ValueError("Could not decode image data")
+            return img
+        elif isinstance(image, np.ndarray):
+            return image
+        else:
+            raise ValueError("Input image must be bytes or numpy array")
+
+    def detect_vehicles(self, image, *, return_boxes=False):
         """
         Detect vehicles in the given image using YOLOv8 models.
         Args:
-            image: Image data as bytes or numpy array (BGR)
+            image: Image data as bytes-like object or numpy array (BGR)
+            return_boxes: Also return per-box detection details
         Returns:
             dict: Contains counts of regular and emergency vehicles
         """
         try:
-            # Accept image as bytes (from Flask file upload) or as numpy array
-            if isinstance(image, bytes):
-                npimg = np.frombuffer(image, np.uint8)
-                img = cv2.imdecode(npimg, cv2.IMREAD_COLOR)
-            elif isinstance(image, np.ndarray):
-                img = image
-            else:
-                raise ValueError("Input image must be bytes or numpy array")
-
-            # Run detection for emergency vehicles
-            results_emergency = self.model_emergency(img)[0]
-            # Run detection for general vehicles
-            results_general = self.model_general(img)[0]
-
-            # Count regular vehicles (car, truck, bus, motorcycle)
-            general_vehicle_count = 0
-            for box in results_general.boxes:
-                class_id = int(box.cls)
-                class_name = self.model_general.names[class_id]
-                if class_name in self.general_vehicle_classes:
-                    general_vehicle_count += 1
-
-            # Count emergency vehicles (all detections in emergency model)
-            emergency_vehicle_count = len(results_emergency.boxes)
-
-            # Prepare detection details (optional, for frontend)
-            detections = []
-            for box in results_general.boxes:
-                class_id = int(box.cls)
-                class_name = self.model_general.names[class_id]
-                if class_name in self.general_vehicle_classes:
-                    detections.append({
-                        'type': 'regular',
-                        'class': class_name,
-                        'conf': float(box.conf),
-                        'xyxy': box.xyxy.tolist()
-                    })
-            for box in results_emergency.boxes:
-                class_id = int(box.cls)
-                class_name = self.model_emergency.names[class_id]
-                detections.append({
-                    'type': 'emergency',
-                    'class': class_name,
-                    'conf': float(box.conf),
-                    'xyxy': box.xyxy.tolist()
-                })
-
-            self.logger.info(f"Detected: {general_vehicle_count} regular, {emergency_vehicle_count} emergency vehicles")
-
-            return {
-                "regular_count": general_vehicle_count-emergency_vehicle_count,
-                "emergency_count": emergency_vehicle_count,
-                "detections": detections
-            }
+            img = self.decode_image(image)
         except Exception as e:
             self.logger.error(f"Error in detect_vehicles: {str(e)}")
-            return {
-                "regular_count": 0,
-                "emergency_count": 0,
-                "detections": [],
-                "error": str(e)
+            return self._empty_result(e, return_boxes)
+        return self.detect_vehicles_batch([img], return_boxes=return_boxes)[0]
+
+    def detect_vehicles_batch(self, imgs, return_boxes=False):
+        """
+        Detect vehicles in several images with a single forward pass per model.
+        Args:
+            imgs: List of decoded images (numpy arrays, BGR)
+            return_boxes: Bool for the whole batch, or one bool per image, selecting
+                which results include per-box detection details
+        Returns:
+            list: One result dict per image, in the same order as imgs
+        """
+        if not imgs:
+            return []
+        if isinstance(return_boxes, bool):
+            return_boxes = [return_boxes] * len(imgs)
+        try:
+            if self._batch_size is None:
+                return self._detect_chunk(imgs, return_boxes)
+            # Static-batch engines: run fixed-size chunks, padding the last one
+            results = []
+            for start in range(0, len(imgs), self._batch_size):
+                chunk = imgs[start:start + self._batch_size]
+                padding = self._batch_size - len(chunk)
+                results.extend(self._detect_chunk(
+                    chunk + [np.zeros_like(chunk[0])] * padding,
+                    return_boxes[start:start + self._batch_size] + [False] * padding
+                )[:len(chunk)])
+            return results
+        except Exception as e:
+            self.logger.error(f"Error in detect_vehicles_batch: {str(e)}")
+            return [self._empty_result(e, boxes) for boxes in return_boxes]
+
+    @torch.inference_mode()
+    def _detect_chunk(self, imgs, return_boxes):
+        """Run both models once over a list of images and summarize each result."""
+        if self._device is not None:
+            source, letterbox = self._to_device_batch(imgs)
+        else:
+            # Shrink frames to the model input size up front so full-resolution
+            # pixels never travel further; Ultralytics treats a list source as one batch
+            source, letterbox = [], []
+            for img in imgs:
+                padded, ratio, pad = self._letterbox(img)
+                source.append(padded)
+                letterbox.append((ratio, pad))
+        if self._device is not None:
+            # The upload ran on the current stream; both model streams must wait for it
+            current = torch.cuda.current_stream()
+            self._stream_emergency.wait_stream(current)
+            self._stream_general.wait_stream(current)
+            pending = self._stream_pool.submit(self._predict_on_stream, self.model_emergency, source, self._stream_emergency)
+            results_general = self._predict_on_stream(self.model_general, source, self._stream_general)
+            results_emergency = pending.result()
+        else:
+            results_emergency = self.model_emergency(source, **self._infer_kwargs)
+            results_general = self.model_general(source, **self._infer_kwargs)
+
+        return [
+            self._summarize(result_general, result_emergency, lb, boxes)
+            for result_general, result_emergency, lb, boxes
+            in zip(results_general, results_emergency, letterbox, return_boxes)
+        ]
+
+    @torch.inference_mode()
+    def _predict_on_stream(self, model, source, stream):
+        """Run a model with its kernels queued on the given CUDA stream."""
+        with torch.cuda.stream(stream):
+            source.record_stream(stream)
+            results = model(source, **self._infer_kwargs)
+        stream.synchronize()
+        return results
+
+    def _letterbox(self, img):
+        """
+        Resize an image to the model input size, keeping its aspect ratio.
+        Returns:
+            tuple: (padded image, scale ratio, (pad_x, pad_y))
+        """
+        h, w = img.shape[:2]
+        ratio = min(self._imgsz / h, self._imgsz / w)
+        new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+        if (new_w, new_h) != (w, h):
+            # INTER_AREA avoids aliasing when shrinking large camera frames
+            interpolation = cv2.INTER_AREA if ratio < 1 else cv2.INTER_LINEAR
+            img = cv2.resize(img, (new_w, new_h), interpolation=interpolation)
+        pad_x, pad_y = (self._imgsz - new_w) / 2, (self._imgsz - new_h) / 2
+        top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+        left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+        img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+        return img, ratio, (left, top)
+
+    def _to_device_batch(self, imgs):
+        """
+        Upload a list of BGR images as one normalized BCHW tensor on the GPU.
+        Returns:
+            tuple: (tensor, list of (ratio, pad) per image for mapping boxes back)
+        """
+        n = len(imgs)
+        if self._staging is None or self._staging.shape[0] < n:
+            self._staging = torch.empty((n, self._imgsz, self._imgsz, 3), dtype=torch.uint8).pin_memory()
+        staging = self._staging[:n]
+        staging_np = staging.numpy()
+        letterbox = []
+        for i, img in enumerate(imgs):
+            padded, ratio, pad = self._letterbox(img)
+            staging_np[i] = padded
+            letterbox.append((ratio, pad))
+
+        batch = staging.to(self._device, non_blocking=True)
+        # BGR -> RGB, NHWC -> NCHW, scale to [0, 1]
+        batch = batch.flip(3).permute(0, 3, 1, 2).contiguous()
+        batch = batch.half() if self._infer_kwargs['half'] else batch.float()
+        return batch.div_(255.0), letterbox
+
+    def _summarize(self, results_general, results_emergency, letterbox=None, return_boxes=False):
+        """
+        Build the result dict for one image from both models' results.
+        letterbox is the (ratio, pad) used on the input, if any, so boxes can
+        be reported in original image coordinates.
+        """
+        # Move class ids to the host once per image instead of once per box
+        boxes_general = results_general.boxes
+        cls_general = boxes_general.cls.to(torch.int64).cpu().numpy()
+        # Count regular vehicles (car, truck, bus, motorcycle)
+        general_mask = np.isin(cls_general, self._general_ids)
+        general_vehicle_count = int(general_mask.sum())
+
+        # Count emergency vehicles (all detections in emergency model)
+        boxes_emergency = results_emergency.boxes
+        emergency_vehicle_count = len(boxes_emergency)
+
+        self.logger.info(f"Detected: {general_vehicle_count} regular, {emergency_vehicle_count} emergency vehicles")
+
+        # The emergency model can find vehicles the general model missed, so clamp at zero
+        result = {
+            "regular_count": max(0, general_vehicle_count-emergency_vehicle_count),
+            "emergency_count": emergency_vehicle_count
+        }
+        if return_boxes:
+            result["detections"] = (
+                self._box_details('regular', self.model_general.names, boxes_general, general_mask, letterbox)
+                + self._box_details('emergency', self.model_emergency.names, boxes_emergency, None, letterbox)
+            )
+        return result
+
+    def _box_details(self, vehicle_type, names, boxes, mask, letterbox):
+        """Convert a set of boxes into detection dicts with one host transfer per tensor."""
+        cls = boxes.cls.to(torch.int64).cpu().numpy()
+        conf = boxes.conf.cpu().numpy()
+        xyxy = self._unletterbox(boxes.xyxy.cpu().numpy(), letterbox)
+        if mask is not None:
+            cls, conf, xyxy = cls[mask], conf[mask], xyxy[mask]
+        cls, conf, xyxy = cls.tolist(), conf.tolist(), xyxy.tolist()
+        return [
+            {
+                'type': vehicle_type,
+                'class': names[cls[i]],
+                'conf': conf[i],
+                'xyxy': [xyxy[i]]
             }
+            for i in range(len(cls))
+        ]
+
+    @staticmethod
+    def _unletterbox(xyxy, letterbox):
+        """Map boxes from letterboxed input coordinates back to the original image."""
+        if letterbox is None:
+            return xyxy
+        ratio, (pad_x, pad_y) = letterbox
+        return (xyxy - np.array([pad_x, pad_y, pad_x, pad_y], dtype=xyxy.dtype)) / ratio
+
+    @staticmethod
+    def _empty_result(error, return_boxes=False):
+        """Result dict returned when detection fails, shaped like a successful one."""
+        result = {
+            "regular_count": 0,
+            "emergency_count": 0,
+            "error": str(error)
+        }
+        if return_boxes:
+            result["detections"] = []
+        return result